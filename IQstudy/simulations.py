@@ -2,6 +2,9 @@
     A simulation study to assess the confidence level of James Covacich's IQ estiamtes for AGS 4F in 2023.
 """
 # If you have missing libraries, run the following on the command line: pip install numpy, matplotlib
+import sys, os, time, json, itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from statistics import NormalDist
 import numpy as np
 import pylab as plt
 
@@ -18,15 +21,19 @@ def new_population(N_people):
     return 100 + 15*np.random.randn(int(N_people))
 
 
+# Covacich's result
+JC4F_IQS = [118.12, 108.46, 107.30, 106.03, 105.95, 105.45, 104.88,
+            104.78, 104.74, 104.71, 104.65, 104.27, 103.98, 103.84,
+            103.84, 103.77, 103.69, 102.22, 103.03, 102.98, 102.97,
+            102.69, 102.28, 102.33, 102.16, 100.98, 100.78,  99.57,
+             99.60,  99.44,  98.54,  98.54,  97.93,  97.48,  97.47]
+
+
 def study_4F(N_years=30, N_tries=100):
     """ A simulation study to assess the reasonableness of James Covacich's results of Dec 2023 """
     
     # Covacich's result
-    jc4F_IQs = [118.12, 108.46, 107.30, 106.03, 105.95, 105.45, 104.88,
-                104.78, 104.74, 104.71, 104.65, 104.27, 103.98, 103.84,
-                103.84, 103.77, 103.69, 102.22, 103.03, 102.98, 102.97,
-                102.69, 102.28, 102.33, 102.16, 100.98, 100.78,  99.57,
-                 99.60,  99.44,  98.54,  98.54,  97.93,  97.48,  97.47]
+    jc4F_IQs = JC4F_IQS
     
     # We'll collect all possible "close matches" to JC's result in the following list
     closest_results = []
@@ -103,7 +110,189 @@ def study_4F(N_years=30, N_tries=100):
     plt.xlabel("IQ"); plt.legend()
 
 
+def median_halfrange(samples, axis=-1):
+    """ @return: (median, (max-min)/2) along the axis, from a single partial sort """
+    n = samples.shape[axis]
+    k = sorted({0, (n-1)//2, n//2, n-1})
+    part = np.partition(samples, k, axis=axis)
+    take = lambda i: np.take(part, i, axis=axis)
+    return (take((n-1)//2) + take(n//2))/2, (take(n-1) - take(0))/2
+
+
+# The assumptions made in study_4F(), which may be varied in study_4F_batched() & sweep_4F()
+ASSUMPTIONS = dict(zone_size=100e3, # People living in the enrollment zone
+                   male_fraction=0.5,
+                   cutoff=85, # Candidates with IQ below this are discarded
+                   N_boys=550, # Boys per year
+                   N_classes=15, # Classes per year
+                   bright_classes=2, bright_fraction=0.5, # The top classes are this fraction the boys with the highest IQs
+                   dim_classes=5, dim_fraction=0.5, # The lowest classes are this fraction the boys with the lowest IQs
+                   closeness=0.1) # Median & 1/2 range must differ by less than this fraction to match
+HIST_BINS = np.linspace(90, 130, 31) # For the histogram of IQs in matching classes
+
+
+def year_group(rng, A, sampling="population"):
+    """ @param A: assumptions like ASSUMPTIONS
+        @param sampling: "population" to select the year group from a simulated population of the zone, as in study_4F(),
+                         or "rejection" or "inverse_cdf" to sample the truncated normal distribution directly.
+        @return: IQs for the year group """
+    if (sampling == "population"):
+        agszone_IQs = 100 + 15*rng.standard_normal(int(A["zone_size"]))
+        agscandidate_IQs = agszone_IQs[rng.integers(0, len(agszone_IQs), int(A["male_fraction"]*len(agszone_IQs)))]
+        agscandidate_IQs = agscandidate_IQs[agscandidate_IQs >= A["cutoff"]]
+        return agscandidate_IQs[rng.integers(0, len(agscandidate_IQs), int(A["N_boys"]))]
+    
+    # Without materializing the population, the year group is simply a sample of the normal distribution above the cutoff
+    N_boys = int(A["N_boys"])
+    if (sampling == "rejection"):
+        agsyear_IQs = np.empty(0)
+        while (len(agsyear_IQs) < N_boys):
+            IQs = 100 + 15*rng.standard_normal(2*N_boys)
+            agsyear_IQs = np.concatenate([agsyear_IQs, IQs[IQs >= A["cutoff"]]])
+        return agsyear_IQs[:N_boys]
+    elif (sampling == "inverse_cdf"):
+        IQ = NormalDist(100, 15)
+        return np.array([IQ.inv_cdf(u) for u in rng.uniform(IQ.cdf(A["cutoff"]), 1, N_boys)])
+    raise ValueError("Unknown sampling '%s'"%sampling)
+
+def year_bracket(rng, A, sampling="population"):
+    """ @return: the sorted IQs of the year group, excluding the brights & dimms (see study_4F()) """
+    agsyear_IQs = np.sort(year_group(rng, A, sampling))
+    N_perclass = int(len(agsyear_IQs)/A["N_classes"])
+    N_brights = int(A["bright_fraction"] * A["bright_classes"]*N_perclass)
+    N_dimms = int(A["dim_fraction"] * A["dim_classes"]*N_perclass)
+    # The percentiles that bracket the year group in study_4F() fall between these order statistics
+    return agsyear_IQs[N_dimms:len(agsyear_IQs)-N_brights]
+
+
+def study_4F_batched(N_years=30, N_tries=100, seed=None, chunk=100000, sampling="population", **assumptions):
+    """ The same simulation as study_4F(), but with all tries for a year drawn as one (tries x class size) array,
+        and without any plots. Tries are done in chunks to limit memory use.
+        @param seed: for numpy.random.default_rng(), to make the results reproducible.
+        @param sampling: how to generate the year group, see year_group().
+        @param assumptions: to override the defaults in ASSUMPTIONS.
+        @return: (likelihood [%], number of matches) - arrays with one value per year,
+                 histogram (over HIST_BINS) of the IQs in all matching classes """
+    A = dict(ASSUMPTIONS, **assumptions)
+    rng = np.random.default_rng(seed)
+    jc4F_stats = median_halfrange(np.asarray(JC4F_IQS))
+    N_tries = int(N_tries)
+    
+    likelihoods, N_matches = np.zeros(N_years), np.zeros(N_years, int)
+    match_hist = np.zeros(len(HIST_BINS)-1, int)
+    for year in range(N_years):
+        agsyearbracket_IQs = year_bracket(rng, A, sampling)
+        N_perclass = int(A["N_boys"]/A["N_classes"])
+        
+        # All the random classes at once, a chunk at a time. With the bracket sorted, the order statistics of
+        # a class are those of its (small integer) indices, so the IQs need not be gathered for the whole class.
+        N = N_perclass
+        dtype = np.int16 if (len(agsyearbracket_IQs) < 2**15) else np.int32
+        for n in range(0, N_tries, chunk):
+            class_indices = rng.integers(0, len(agsyearbracket_IQs), (min(chunk, N_tries-n), N), dtype=dtype)
+            class_indices.sort(axis=-1) # Radix sort for int16, much faster than partition()
+            order_IQs = agsyearbracket_IQs[class_indices[:,[0, (N-1)//2, N//2, N-1]]]
+            medians, halfranges = (order_IQs[:,1] + order_IQs[:,2])/2, (order_IQs[:,3] - order_IQs[:,0])/2
+            is_match = (abs(medians/jc4F_stats[0] - 1) < A["closeness"]) & (abs(halfranges/jc4F_stats[1] - 1) < A["closeness"])
+            N_matches[year] += np.count_nonzero(is_match)
+            match_hist += np.histogram(agsyearbracket_IQs[class_indices[is_match]], bins=HIST_BINS)[0]
+        likelihoods[year] = N_matches[year]/N_tries * 100
+    
+    return likelihoods, N_matches, match_hist
+
+
+def check_sampling(N_years=1000, seed=2023, **assumptions):
+    """ Checks that sampling the truncated normal distribution directly gives year groups that are statistically
+        equivalent to those selected from a simulated population, with two-sample Kolmogorov-Smirnov tests.
+        @return: {sampling: KS statistic} """
+    A = dict(ASSUMPTIONS, **assumptions)
+    rng = np.random.default_rng(seed)
+    reference = np.sort(np.concatenate([year_group(rng, A, "population") for year in range(N_years)]))
+    results = {}
+    for sampling in ["rejection", "inverse_cdf"]:
+        IQs = np.sort(np.concatenate([year_group(rng, A, sampling) for year in range(N_years)]))
+        both = np.concatenate([reference, IQs])
+        KS = np.max(np.abs(np.searchsorted(reference, both, side="right")/len(reference) - np.searchsorted(IQs, both, side="right")/len(IQs)))
+        KS_crit = 1.949 * np.sqrt((len(reference)+len(IQs))/(len(reference)*len(IQs))) # For a significance level of 0.1%
+        print(f"Sampling '{sampling}' vs 'population': KS statistic {KS:.4f} (critical value {KS_crit:.4f})")
+        assert (KS < KS_crit), f"Sampling '{sampling}' is significantly different from 'population'"
+        results[sampling] = KS
+    return results
+
+def benchmark_sampling(N_years=100, seed=2023, **assumptions):
+    """ Prints & returns the time it takes per year to generate the year bracket, for each sampling method [sec] """
+    A = dict(ASSUMPTIONS, **assumptions)
+    rng = np.random.default_rng(seed)
+    results = {}
+    for sampling in ["population", "rejection", "inverse_cdf"]:
+        t0 = time.perf_counter()
+        for year in range(N_years):
+            year_bracket(rng, A, sampling)
+        results[sampling] = (time.perf_counter() - t0)/N_years
+        print(f"Sampling '{sampling}': {results[sampling]*1e3:.2f} msec per year, {results['population']/results[sampling]:.0f}x speedup")
+    return results
+
+
+def _sweep_point(index, assumptions, seed, N_years, N_tries, sampling):
+    likelihoods, N_matches, match_hist = study_4F_batched(N_years, N_tries, seed, sampling=sampling, **assumptions)
+    return dict(index=index, assumptions=assumptions, N_years=N_years, N_tries=N_tries, seed=str(seed.entropy), sampling=sampling,
+                likelihoods=likelihoods.tolist(), N_matches=N_matches.tolist(), match_hist=match_hist.tolist())
+
+def sweep_4F(grid, N_years=30, N_tries=1e5, seed=2023, workers=None, checkpoint=None, sampling="population"):
+    """ Runs study_4F_batched() for all combinations of the assumptions in 'grid', in parallel processes.
+        Every combination gets its own independent random stream, spawned from 'seed', so the results do not
+        depend on the number of workers or the order in which they complete.
+        @param grid: like {"cutoff": [80, 85, 90], "closeness": [0.05, 0.1]}, the rest as in ASSUMPTIONS.
+        @param checkpoint: a .jsonl file to append results to as they complete; results already in it are
+                           not re-computed, so that an interrupted sweep can be resumed. A last line that was
+                           cut short by the interruption is dropped.
+        @param sampling: how to generate the year groups, see year_group().
+        @return: list of results (dicts) in the order of the combinations """
+    names = sorted(grid)
+    points = [{n: (v.item() if hasattr(v, "item") else v) for n, v in zip(names, values)}
+              for values in itertools.product(*[grid[n] for n in names])]
+    seeds = np.random.SeedSequence(seed).spawn(len(points))
+    
+    results = {}
+    if checkpoint and os.path.exists(checkpoint): # Resume
+        with open(checkpoint, "rb+") as f:
+            lines = f.readlines()
+            if lines and not lines[-1].endswith(b"\n"): # Interrupted while writing it, so appending would corrupt the next one too
+                print(f"Dropping the incomplete last line of {checkpoint}")
+                f.truncate(f.tell() - len(lines.pop()))
+        for line in lines:
+            r = json.loads(line)
+            i = r["index"]
+            if (i < len(points)) and (r["assumptions"] == points[i]) and \
+               (r["N_years"], r["N_tries"], r["seed"], r["sampling"]) == (N_years, N_tries, str(seed), sampling):
+                results[i] = r
+    todo = [i for i in range(len(points)) if (i not in results)]
+    print(f"Sweeping {len(todo)} of {len(points)} combinations of assumptions")
+    
+    with ProcessPoolExecutor(workers) as pool:
+        jobs = [pool.submit(_sweep_point, i, points[i], seeds[i], N_years, N_tries, sampling) for i in todo]
+        for job in as_completed(jobs):
+            r = job.result()
+            results[r["index"]] = r
+            if checkpoint:
+                with open(checkpoint, "a") as f:
+                    f.write(json.dumps(r) + "\n")
+                    f.flush(); os.fsync(f.fileno()) # On disk before the next one, in case of a crash
+            print(f"{len(results)}/{len(points)}: {r['assumptions']} mean likelihood {np.mean(r['likelihoods']):.2f} %")
+    return [results[i] for i in range(len(points))]
+
 
 if __name__ == "__main__":
-    study_4F()
-    plt.show()
\ No newline at end of file
+    if (sys.argv[-1] == "--batched"): # Many more tries, but no plots
+        likelihoods, N_matches, match_hist = study_4F_batched(N_years=30, N_tries=1e6, seed=2023)
+        for year, likelihood in enumerate(likelihoods):
+            print(f"Year {year} likelihood of encountering Covacich's result: {likelihood:.2f} %")
+    elif (sys.argv[-1] == "--sweep"): # How sensitive are the results to the assumptions?
+        sweep_4F({"cutoff": [80, 85, 90], "N_classes": [12, 15, 18], "closeness": [0.05, 0.1]},
+                 checkpoint="sweep_4F.jsonl")
+    elif (sys.argv[-1] == "--check"): # Direct sampling of the year group vs simulating the whole population
+        check_sampling()
+        benchmark_sampling()
+    else:
+        study_4F()
+        plt.show()
\ No newline at end of file
@@ -0,0 +1,220 @@
+""" Benchmarks of the hot paths in fractals, IQstudy, face_id & spy-ear, to check performance changes before
+    deploying them. Every case runs in a fresh process, so that imports, JIT compilation & settings like
+    mandelbrot.MAX_ITERATIONS don't leak between cases.
+
+    Each measurement repeats a case for at least 0.2 sec, and a case only counts as slower if it is beyond both the
+    tolerance and the noise between measurements, and still is when it is run again.
+
+    Examples:
+        python benchmarks.py --save baseline.json # Before the change
+        python benchmarks.py --baseline baseline.json # After the change: exits with 1 if anything got slower
+        python benchmarks.py --filter mandelbrot --profile # Only the cases with "mandelbrot" in the name, with hot paths
+
+    @requires: python3, numpy, matplotlib, scipy, opencv-python, opencv-contrib-python, Pillow
+    @optional-requires: numba
+
+    @author: adriaan & arami peens-hough
+"""
+import sys, os, io, time, json, tempfile, platform, argparse, contextlib, timeit
+import cProfile, pstats
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+# Each case sets up & returns (function to time, units of work per call, name of the units)
+
+def case_fractal(set_name, engine, points, iterations):
+    sys.path.insert(0, os.path.join(ROOT, "fractals"))
+    import mandelbrot
+    if (engine == "numba") and not mandelbrot.NUMBA:
+        return None
+    mandelbrot.MAX_ITERATIONS = iterations
+    fn = getattr(mandelbrot, set_name if (engine == "numba") else set_name+"_numpy")
+    if (set_name == "mandelbrot_set"):
+        x, y = np.meshgrid(np.linspace(-2, 1, points), np.linspace(-1.5, 1.5, points))
+        args = (x, y, True)
+    else:
+        x, y = np.meshgrid(np.linspace(-2, 2, points), np.linspace(-2, 2, points))
+        args = (x, y, 0.285, 0.01, True)
+    return (lambda: fn(*args)), points*points, "pixels"
+
+def case_study_4F(engine, N_tries):
+    sys.path.insert(0, os.path.join(ROOT, "IQstudy"))
+    import matplotlib; matplotlib.use("Agg")
+    import simulations
+    import pylab as plt
+    def run():
+        np.random.seed(1) # study_4F uses the legacy global generator, and fails if there are no matches at all
+        with contextlib.redirect_stdout(io.StringIO()):
+            if (engine == "batched"):
+                simulations.study_4F_batched(N_years=1, N_tries=N_tries, seed=1)
+            else:
+                simulations.study_4F(N_years=1, N_tries=N_tries)
+        plt.close("all")
+    return run, 1, "years"
+
+def _synthetic_faces(rootfolder, names=3, per_name=20):
+    rng = np.random.default_rng(1)
+    from PIL import Image
+    for n in range(names):
+        os.makedirs(os.path.join(rootfolder, "name%d"%n), exist_ok=True)
+        for i in range(per_name):
+            Image.fromarray(rng.integers(0, 256, (200,200), np.uint8)).save(os.path.join(rootfolder, "name%d"%n, "%d.png"%i))
+
+def case_train_faces(names, per_name):
+    sys.path.insert(0, os.path.join(ROOT, "face_id"))
+    import face_id
+    rootfolder = os.path.join(tempfile.mkdtemp(), "faces")
+    _synthetic_faces(rootfolder, names, per_name)
+    return (lambda: face_id.train_faces(rootfolder)), names*per_name, "faces"
+
+def case_detectface(width, height):
+    sys.path.insert(0, os.path.join(ROOT, "face_id"))
+    import cv2, face_id
+    rootfolder = os.path.join(tempfile.mkdtemp(), "faces")
+    _synthetic_faces(rootfolder, 2, 5)
+    face_id.train_faces(rootfolder)
+    recognizer = cv2.face.LBPHFaceRecognizer_create()
+    recognizer.read(rootfolder+".yml")
+    labels = face_id.load_labels(rootfolder+".yml")
+    # Smooth noise rather than white noise, so that the cascade doesn't reject everything at the first stage
+    frames = [cv2.GaussianBlur(np.random.default_rng(i).integers(0, 256, (height,width,3), np.uint8), (0,0), 3) for i in range(10)]
+    return (lambda: [face_id.mod_detectface(frame.copy(), recognizer, labels) for frame in frames]), len(frames), "frames"
+
+def case_checkwav(seconds, samplerate):
+    sys.path.insert(0, os.path.join(ROOT, "spy-ear"))
+    import matplotlib; matplotlib.use("Agg")
+    import checkwav
+    data = (np.random.default_rng(1).normal(0, 300, seconds*samplerate) + 100).astype(np.int16)
+    level = checkwav.center_level(data)
+    return (lambda: [chunk for chunk in checkwav.filter_chunks(data, level)]), len(data), "samples"
+
+
+CASES = {} # name: (case function, args)
+for engine in ["numba", "numpy"]:
+    for points in [256, 1024]:
+        for iterations in [100, 1000]:
+            for set_name in ["mandelbrot_set", "julia_set"]:
+                CASES["%s/%s/%dpx/%dit"%(set_name, engine, points, iterations)] = (case_fractal, (set_name, engine, points, iterations))
+CASES["study_4F/1000tries"] = (case_study_4F, ("loop", 1000))
+CASES["study_4F_batched/1000tries"] = (case_study_4F, ("batched", 1000))
+CASES["train_faces/3x20"] = (case_train_faces, (3, 20))
+CASES["mod_detectface/640x480"] = (case_detectface, (640, 480))
+CASES["checkwav/filter_chunks/60s"] = (case_checkwav, (60, 44100))
+
+
+def _run_case(name, repeat, profile, top=15):
+    """ Runs in a fresh process. Each of the 'repeat' measurements calls the case as many times as it takes to
+        run for at least 0.2 sec, since single calls of a few millisec are mostly noise.
+        @return: dict with the timings per call, or None if the case doesn't apply (e.g. numba isn't available) """
+    fn, args = CASES[name]
+    setup = fn(*args)
+    if (setup is None):
+        return None
+    run, units, unit_name = setup
+    run() # Warm up, including any JIT compilation
+    timer = timeit.Timer(run)
+    number = timer.autorange()[0]
+    times = [t/number for t in timer.repeat(repeat, number)]
+    result = dict(seconds=min(times), median=float(np.median(times)), spread=float(np.std(times)), number=number,
+                  rate=units/min(times), units=unit_name)
+    if profile:
+        profiler = cProfile.Profile()
+        profiler.runcall(run)
+        stats = pstats.Stats(profiler)
+        hot = sorted(stats.stats.items(), key=lambda item: -item[1][3])[:top] # By cumulative time
+        result["profile"] = [dict(function="%s:%d(%s)"%(os.path.relpath(f, ROOT) if f.startswith(ROOT) else f, line, fn_name),
+                                  calls=nc, tottime=tt, cumtime=ct) for (f, line, fn_name), (cc, nc, tt, ct, callers) in hot]
+    return result
+
+
+def run_benchmarks(names, repeat=5, profile=False):
+    """ @return: dict with "meta" describing the machine, the "cases" that were run, their "results" by case name,
+                 and the error of each case that "failed" by case name """
+    results, failed = {}, {}
+    spawn = get_context("spawn")
+    for name in names:
+        with ProcessPoolExecutor(1, mp_context=spawn) as pool:
+            try:
+                result = pool.submit(_run_case, name, repeat, profile).result()
+            except Exception as e:
+                print("%-40s failed: %r"%(name, e), file=sys.stderr)
+                failed[name] = repr(e)
+                continue
+        if (result is None):
+            print("%-40s skipped"%name, file=sys.stderr)
+            continue
+        results[name] = result
+        print("%-40s %9.4f sec  %10.4g %s/sec"%(name, result["seconds"], result["rate"], result["units"]), file=sys.stderr)
+        for hot in result.get("profile", []):
+            print("    %8.4f %8.4f %9d  %s"%(hot["cumtime"], hot["tottime"], hot["calls"], hot["function"]), file=sys.stderr)
+    try:
+        import numba
+        numba_version = numba.__version__
+    except ImportError:
+        numba_version = None
+    meta = dict(time=time.strftime("%Y-%m-%d %H:%M:%S"), platform=platform.platform(), cpus=os.cpu_count(),
+                python=platform.python_version(), numpy=np.__version__, numba=numba_version, repeat=repeat)
+    return dict(meta=meta, cases=list(names), results=results, failed=failed)
+
+def compare(results, baseline, tolerance=0.1, noise=3):
+    """ Prints the change in time of every case against the baseline.
+        Cases in the baseline that failed or were skipped this time also count as regressions.
+        @param tolerance: fraction by which a case may be slower before it counts as a regression
+        @param noise: number of spreads (standard deviations of the measurements, the larger of the baseline's & now)
+                      by which a case must also be slower, so that noisy cases don't fail at random
+        @return: list of the names of the cases that regressed """
+    regressed = []
+    print("%-40s %9s %9s %8s"%("case", "baseline", "now", "change"), file=sys.stderr)
+    for name in results.get("cases", results["results"]):
+        if (name not in baseline["results"]):
+            continue
+        if (name not in results["results"]):
+            regressed.append(name)
+            print("%-40s %9.4f %9s %8s %s"%(name, baseline["results"][name]["seconds"], "-", "", "FAILED" if (name in results.get("failed", {})) else "SKIPPED"), file=sys.stderr)
+            continue
+        before, now = baseline["results"][name]["seconds"], results["results"][name]["seconds"]
+        spread = max(baseline["results"][name].get("spread", 0), results["results"][name].get("spread", 0))
+        change = now/before - 1
+        flag = ""
+        if (change > tolerance) and (now > before + noise*spread):
+            regressed.append(name)
+            flag = "REGRESSION"
+        print("%-40s %9.4f %9.4f %+7.1f%% %s"%(name, before, now, 100*change, flag), file=sys.stderr)
+    return regressed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the hot paths, optionally against a saved baseline.")
+    parser.add_argument("--filter", default="", help="only run the cases with this in their name")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--profile", action="store_true", help="also list the hot paths of each case, from cProfile")
+    parser.add_argument("--save", default=None, help="write the results to this JSON file, e.g. to use as a baseline")
+    parser.add_argument("--baseline", default=None, help="JSON file of previous results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="fraction slower than the baseline that counts as a regression")
+    parser.add_argument("--noise", type=float, default=3, help="number of spreads of the timings that a regression must also exceed")
+    parser.add_argument("--list", action="store_true", help="only list the cases")
+    args = parser.parse_args()
+
+    names = [name for name in CASES if (args.filter in name)]
+    if args.list:
+        print("\n".join(names))
+        sys.exit()
+    results = run_benchmarks(names, args.repeat, args.profile)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=1)
+    else:
+        json.dump(results, sys.stdout, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressed = compare(results, baseline, args.tolerance, args.noise)
+        if regressed: # Confirm by running those cases again, in case the machine was just busy
+            print("Running the %d regressed cases again"%len(regressed), file=sys.stderr)
+            again = run_benchmarks(regressed, args.repeat)
+            if compare(again, baseline, args.tolerance, args.noise):
+                sys.exit(1)
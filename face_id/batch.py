@@ -0,0 +1,118 @@
+""" Headless face recognition over directories of images and recorded video files, e.g. to reprocess archives.
+    Results are written as JSON lines, one per image or video frame:
+        {"source": "clips/door.mp4", "frame": 42, "faces": [{"box": [x,y,w,h], "name": "ann", "confidence": 35.2}]}
+    with "error": "unreadable" added for image files that can't be decoded.
+    
+    Example:
+        python batch.py faces.yml photos/ clips/door.mp4 --out results.jsonl --every 5
+    
+    @requires: python3, numpy, opencv-python, opencv-contrib-python, Pillow
+    
+    @author adriaan, benjamin, arami peens-hough
+"""
+import cv2
+import sys, os, time, json, argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import face_id
+
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff"}
+VIDEO_EXTENSIONS = {".mp4", ".avi", ".mov", ".mkv", ".m4v", ".webm"}
+
+
+def iter_files(paths):
+    """ @return: generator of all image & video files in 'paths', which may be files or directories """
+    for path in paths:
+        if os.path.isdir(path):
+            for folder, dirs, files in os.walk(path):
+                dirs.sort()
+                for fn in sorted(files):
+                    if (os.path.splitext(fn)[1].lower() in IMAGE_EXTENSIONS|VIDEO_EXTENSIONS):
+                        yield os.path.join(folder, fn)
+        else:
+            yield path
+
+def iter_frames(paths, every=1):
+    """ Streams the frames to process: images as their filenames, so that they are decoded by the workers, and
+        video frames decoded one at a time, as grayscale to save on copying them to the workers.
+        @param every: only process every this many frames of videos.
+        @return: generator of (source, frame number, filename or grayscale image) """
+    for fn in iter_files(paths):
+        if (os.path.splitext(fn)[1].lower() in VIDEO_EXTENSIONS):
+            video = cv2.VideoCapture(fn)
+            frame = 0
+            while True:
+                if (frame % every == 0):
+                    ret, image = video.read()
+                    if not ret: break
+                    yield (fn, frame, cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
+                elif not video.grab(): # Skip without decoding
+                    break
+                frame += 1
+            video.release()
+        else:
+            yield (fn, 0, fn)
+
+
+_RECOGNIZER, _LABELS = None, None # One per worker process
+
+def _init_worker(model_fn):
+    global _RECOGNIZER, _LABELS
+    cv2.setNumThreads(1) # The parallelism is in the processes
+    _RECOGNIZER = cv2.face.LBPHFaceRecognizer_create()
+    _RECOGNIZER.read(model_fn)
+    _LABELS = face_id.load_labels(model_fn)
+
+def _recognize(source, frame, image):
+    if isinstance(image, str):
+        image = cv2.imread(image, cv2.IMREAD_GRAYSCALE)
+        if (image is None): # Corrupt, or not an image after all
+            return dict(source=source, frame=frame, faces=[], error="unreadable")
+    faces = face_id.detectfaces(image, _RECOGNIZER, _LABELS)
+    return dict(source=source, frame=frame, faces=[dict(box=[int(x),int(y),int(w),int(h)], name=name, confidence=round(float(c),2))
+                                                  for (x,y,w,h, name, c) in faces])
+
+
+def recognize_files(paths, model_fn="faces.yml", out="-", workers=None, every=1, max_pending=None):
+    """ Detects & recognizes faces in all images & video frames under 'paths', in parallel worker processes that
+        each load the recognizer once. Results are written in order as JSON lines.
+        @param out: filename for the results, or "-" for stdout.
+        @param every: only process every this many frames of videos.
+        @param max_pending: maximum number of frames in flight, default 4 per worker.
+        @return: dict with frames, faces, seconds & fps """
+    if not os.path.exists(model_fn): # Else every worker fails to start, which only surfaces as a BrokenProcessPool
+        raise FileNotFoundError("No recognizer '%s', train one with face_id.py first"%model_fn)
+    face_id.load_labels(model_fn) # Likewise, fails if there are neither labels nor the folder of faces
+    workers = workers or os.cpu_count()
+    max_pending = max_pending or 4*workers
+    f = sys.stdout if (out == "-") else open(out, "w")
+    N_frames, N_faces = 0, 0
+    t0 = time.perf_counter()
+    def write(result):
+        f.write(json.dumps(result) + "\n")
+        return len(result["faces"])
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(model_fn,)) as pool:
+        pending = deque()
+        for source, frame, image in iter_frames(paths, every):
+            pending.append(pool.submit(_recognize, source, frame, image))
+            if (len(pending) >= max_pending): # Bounded, so that decoding doesn't run away from recognition
+                N_faces += write(pending.popleft().result()); N_frames += 1
+        while pending:
+            N_faces += write(pending.popleft().result()); N_frames += 1
+    if (f is not sys.stdout):
+        f.close()
+    dt = time.perf_counter() - t0
+    print("INFO: %d frames, %d faces in %.1f sec = %.1f frames/sec"%(N_frames, N_faces, dt, N_frames/dt), file=sys.stderr)
+    return dict(frames=N_frames, faces=N_faces, seconds=dt, fps=N_frames/dt)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recognize faces in image & video files, headless.")
+    parser.add_argument("model", help="the trained recognizer, e.g. faces.yml")
+    parser.add_argument("paths", nargs="+", help="image & video files, or directories of them")
+    parser.add_argument("--out", default="-", help="JSON lines file for the results, default stdout")
+    parser.add_argument("--workers", type=int, default=None, help="default all CPU cores")
+    parser.add_argument("--every", type=int, default=1, help="only process every this many video frames")
+    args = parser.parse_args()
+    recognize_files(args.paths, args.model, args.out, args.workers, args.every)
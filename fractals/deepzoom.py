@@ -0,0 +1,91 @@
+""" Deep zooming into the Mandelbrot set, beyond the limits of float64 coordinates, using perturbation theory:
+    a single "reference" orbit is computed in high precision, and every pixel is then iterated as a small
+    float64 delta from that reference.
+
+    @requires: python3, numpy
+    @optional-requires: numba
+
+    @author: adriaan & arami peens-hough
+"""
+from decimal import Decimal, localcontext
+import numpy as np
+
+
+def digits_for(scale):
+    """ @return: the number of decimal digits needed for the reference orbit, to resolve features at 'scale' """
+    return int(-np.log10(scale)) + 20
+
+def reference_orbit(cx, cy, max_iterations, digits):
+    """ Iterates z -> z*z + c in high precision, stopping early if it diverges.
+        @param cx,cy: the reference coordinate, as Decimal or str (floats are not precise enough for deep zooms).
+        @param digits: number of decimal digits to compute with.
+        @return: [Z_0, Z_1, ... Z_N] as complex128, with Z_0 = 0 """
+    with localcontext() as ctx:
+        ctx.prec = digits
+        cx, cy = Decimal(cx), Decimal(cy)
+        zx, zy = Decimal(0), Decimal(0)
+        orbit = [0j]
+        for tick in range(max_iterations):
+            zx, zy = zx*zx - zy*zy + cx, 2*zx*zy + cy
+            orbit.append(complex(float(zx), float(zy)))
+            if (zx*zx + zy*zy > 4): # If > 4 it is definitely diverging
+                break
+    return np.asarray(orbit)
+
+
+try: # If 'numba' is available then use it to accelerate the code
+    from numba import njit, prange
+
+    @njit(parallel=True, cache=True)
+    def _perturbation(orbit, dc, max_iterations):
+        ticks = np.empty(dc.shape, np.int64)
+        for i in prange(dc.size):
+            d, m = 0j, 0
+            tick = max_iterations-1
+            for t in range(max_iterations):
+                d = d*(2*orbit[m] + d) + dc[i] # delta_{n+1} = 2 Z_n delta_n + delta_n**2 + delta_c
+                m += 1
+                z = orbit[m] + d
+                if (z.real**2 + z.imag**2 > 4): # If > 4 it is definitely diverging
+                    tick = t
+                    break
+                if (z.real**2 + z.imag**2 < d.real**2 + d.imag**2) or (m == len(orbit)-1): # Rebase
+                    d, m = z, 0
+            ticks[i] = tick
+        return ticks
+
+except ImportError: # 'numba' not available so use un-accelerated code
+
+    def _perturbation(orbit, dc, max_iterations):
+        ticks = np.full(dc.shape, max_iterations-1)
+        idx = np.arange(dc.size) # Still active points, compacted as they escape
+        d, m, dc = np.zeros(dc.size, complex), np.zeros(dc.size, int), dc.copy()
+        for t in range(max_iterations):
+            if (len(idx) == 0):
+                break
+            d *= 2*orbit[m] + d; d += dc # delta_{n+1} = 2 Z_n delta_n + delta_n**2 + delta_c
+            m += 1
+            z = orbit[m] + d
+            mag2 = z.real**2 + z.imag**2
+            escaped = mag2 > 4 # If > 4 it is definitely diverging
+            if np.any(escaped):
+                ticks[idx[escaped]] = t
+                keep = ~escaped
+                idx, d, m, dc, z, mag2 = idx[keep], d[keep], m[keep], dc[keep], z[keep], mag2[keep]
+            rebase = (mag2 < d.real**2 + d.imag**2) | (m == len(orbit)-1)
+            d[rebase], m[rebase] = z[rebase], 0
+        return ticks
+
+
+def deep_mandelbrot_set(cx, cy, dx, dy, max_iterations=100):
+    """ Generates the "score" from the Mandelbrot iteration for coordinates given as offsets from a reference.
+        Pixels whose orbit gets closer to 0 than the reference, or outlive the reference, are "glitched" and
+        are rebased onto the start of the reference orbit [Zhuoran 2021], so a single reference is enough.
+        @param cx,cy: the reference coordinate, as Decimal or str.
+        @param dx,dy: float64 offsets from the reference, may be arrays for many coordinates.
+        @return: score (same shape as dx & dy), ~0 if it converges to the set, ~1 if it diverges """
+    dx, dy = np.broadcast_arrays(np.asarray(dx, float), np.asarray(dy, float))
+    scale = max(np.ptp(dx), np.ptp(dy), 1e-300)
+    orbit = reference_orbit(cx, cy, max_iterations, digits_for(scale))
+    ticks = _perturbation(orbit, (dx + 1j*dy).ravel(), max_iterations)
+    return 1 - ticks.reshape(dx.shape)/max_iterations
@@ -0,0 +1,149 @@
+""" Headless export of Mandelbrot & Julia frame sequences to PNG files or raw video, without matplotlib figures.
+    Frames are computed in a pool of worker processes and written in order, through a bounded queue.
+
+    Examples:
+        python export.py julia --frames 300 --points 512 --out frames/julia_%05d.png
+        python export.py zoom --center -0.743643887 0.131825904 --width 3 1e-10 --frames 600 --out zoom.rgb
+    Raw video (*.rgb or - for stdout) is 8 bit RGB frames back to back, e.g. for
+        ffmpeg -f rawvideo -pix_fmt rgb24 -s 512x512 -r 30 -i zoom.rgb zoom.mp4
+
+    @requires: python3, numpy, matplotlib
+    @optional-requires: numba
+
+    @author: adriaan & arami peens-hough
+"""
+import os, sys, time, threading, queue, argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from matplotlib.image import imsave
+import mandelbrot
+
+
+def julia_path(frames, radius=0.7885, xrange=(-2,2), yrange=(-2,2)):
+    """ Julia sets with c going once around a circle, like 'funky_julia'.
+        @return: generator of frames like (set function name, set args, xrange, yrange) """
+    for step in range(frames):
+        a = 2*np.pi*step/frames
+        yield ("julia_set", (radius*np.cos(a), radius*np.sin(a)), xrange, yrange)
+
+def zoom_path(frames, center=(-0.743643887, 0.131825904), width=(3, 1e-10)):
+    """ Mandelbrot set zooming in at a constant rate towards 'center', from & to the given widths.
+        @return: generator of frames like (set function name, set args, xrange, yrange) """
+    for w in np.geomspace(*width, frames):
+        yield ("mandelbrot_set", (), (center[0]-w/2, center[0]+w/2), (center[1]-w/2, center[1]+w/2))
+
+
+_LUTS = {} # Colour lookup tables by colormap name, built once per process
+
+def colour_lut(cmap, levels=256):
+    """ @return: (levels x 3) uint8 RGB lookup table for the named matplotlib colormap """
+    if (cmap not in _LUTS):
+        from matplotlib import colormaps
+        _LUTS[cmap] = (colormaps[cmap](np.linspace(0, 1, levels))[:,:3] * 255).round().astype(np.uint8)
+    return _LUTS[cmap]
+
+def render_frame(frame, points, cmap):
+    """ @param frame: like (set function name, set args, xrange, yrange)
+        @return: (points x points x 3) uint8 RGB image, with the origin at the top left """
+    name, args, xrange, yrange = frame
+    score = mandelbrot.render_map(getattr(mandelbrot, name), args, xrange, yrange, points, workers=1)
+    lut = colour_lut(cmap)
+    index = np.clip(score*(len(lut)-1), 0, len(lut)-1).astype(np.intp)
+    return lut[index[::-1]] # Images have y down, but the maps have y up
+
+
+def _write_frames(out, frames_queue, errors):
+    """ Writes the frames from the queue until it gets None. Raw video if 'out' is *.rgb or '-', else PNG files. """
+    raw = (out == "-") or out.endswith(".rgb")
+    try:
+        if raw:
+            stream = sys.stdout.buffer if (out == "-") else open(out, "wb")
+        else:
+            os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+        n = 0
+        while True:
+            rgb = frames_queue.get()
+            if (rgb is None):
+                break
+            if raw:
+                stream.write(rgb.tobytes())
+            else:
+                imsave(out%n, rgb)
+            n += 1
+        if raw and (stream is not sys.stdout.buffer):
+            stream.close()
+    except Exception as e:
+        errors.append(e)
+        while (frames_queue.get() is not None): # Keep draining so that the producer doesn't block forever
+            pass
+
+def _peak_MB():
+    """ @return: the peak memory of this process or of the largest worker process [MB], or None if unknown (Windows) """
+    try:
+        import resource # Only on Unix
+    except ImportError:
+        return None
+    # ru_maxrss is kBytes on Linux but bytes on macOS; children are the worker processes
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak/1024/1024 if (sys.platform == "darwin") else peak/1024
+
+def export_frames(frames, out, points=512, cmap="turbo_r", workers=None, queue_size=16):
+    """ Renders the frames in worker processes and writes them in order.
+        @param frames: iterable of frames like (set function name, set args, xrange, yrange)
+        @param out: PNG filename pattern like "frames/%05d.png", or "*.rgb" or "-" (stdout) for raw RGB video
+        @param queue_size: maximum number of frames in flight, which bounds the memory used
+        @return: dict with frames, seconds, fps & peak memory [MB] (None if unknown) """
+    workers = workers or os.cpu_count()
+    # Import & compile everything before the writer thread & the worker processes start. Where the workers are forked
+    # (Linux) they inherit it instead of each doing it again, and forking while another thread is importing can
+    # deadlock them. Where they are spawned (macOS & Windows) they import afresh, but load the compiled kernels from
+    # numba's cache on disk rather than compiling them again.
+    colour_lut(cmap)
+    mandelbrot.mandelbrot_set(0., 0., True); mandelbrot.julia_set(0., 0., 0., 0., True)
+    frames_queue, errors = queue.Queue(maxsize=queue_size), []
+    writer = threading.Thread(target=_write_frames, args=(out, frames_queue, errors))
+    writer.start()
+
+    t0 = time.perf_counter()
+    n = 0
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque() # Futures in frame order
+        try:
+            for frame in frames:
+                if errors: # The writer failed, so don't render any more frames that can't be written
+                    break
+                pending.append(pool.submit(render_frame, frame, points, cmap))
+                if (len(pending) >= queue_size):
+                    frames_queue.put(pending.popleft().result()); n += 1
+            while pending and not errors:
+                frames_queue.put(pending.popleft().result()); n += 1
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True) # Drop the frames not started yet, after an error
+            frames_queue.put(None)
+            writer.join()
+    if errors:
+        raise errors[0]
+    dt = time.perf_counter() - t0
+
+    peak = _peak_MB()
+    stats = dict(frames=n, seconds=dt, fps=n/dt, peak_MB=peak)
+    print("INFO: %d frames in %.1f sec = %.2f frames/sec, peak memory per process %s MB"%(n, dt, n/dt, "%.0f"%peak if peak else "?"), file=sys.stderr)
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export Mandelbrot & Julia frame sequences, headless.")
+    parser.add_argument("path", choices=["julia", "zoom"], help="julia: c around a circle; zoom: into the Mandelbrot set")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--points", type=int, default=512, help="frame size [pixels]")
+    parser.add_argument("--out", default="frames/%05d.png", help="PNG filename pattern, or *.rgb or - for raw RGB video")
+    parser.add_argument("--cmap", default="turbo_r")
+    parser.add_argument("--workers", type=int, default=None, help="default all CPU cores")
+    parser.add_argument("--radius", type=float, default=0.7885, help="julia: radius of the circle for c")
+    parser.add_argument("--center", type=float, nargs=2, default=(-0.743643887, 0.131825904), help="zoom: target coordinate")
+    parser.add_argument("--width", type=float, nargs=2, default=(3, 1e-10), help="zoom: first & last widths")
+    args = parser.parse_args()
+
+    frames = julia_path(args.frames, args.radius) if (args.path == "julia") else zoom_path(args.frames, args.center, args.width)
+    export_frames(frames, args.out, args.points, args.cmap, args.workers)
@@ -1,4 +1,5 @@
-import turtle
+import turtle, sys
+import numpy as np
 
 
 def mandelbrot_dist(cx,cy, maxticks=1000):
@@ -26,6 +27,21 @@ def dist2colour(dist, colmap=0):
         return (R,G,B)
 
 
+def dist2colours(dist, colmap=0):
+    """ Like dist2colour() but for a whole array of distances at once.
+        @return: (R,G,B) each an array like dist """
+    col = (np.asarray(dist) * 256*256*256).astype(int)
+    R, G, B = (col//256//256) % 256, (col//256) % 256, col % 256
+    if (colmap==1):
+        return (R//2,G//2,B//2)
+    elif (colmap==2):
+        return (128+R//2,128+G//2,128+B//2)
+    elif (colmap==3):
+        return (64+R//2,64+G//2,64+B//2)
+    else:
+        return (R,G,B)
+
+
 def draw_set(set_function, xrange=(-100,50), yrange=(-100,100), step=5, zoom=1, x0y0=(0,0), colmap=0):
     scale = 3.0/zoom/max([max(xrange), max(yrange)])
     x0,y0 = x0y0
@@ -40,6 +56,49 @@ def draw_set(set_function, xrange=(-100,50), yrange=(-100,100), step=5, zoom=1,
             turtle.color(dist2colour(dist, colmap=colmap))
             turtle.forward(1)
         
+
+
+def draw_set_fast(set_function=None, xrange=(-100,50), yrange=(-100,100), step=5, zoom=1, x0y0=(0,0), colmap=0, maxticks=1000):
+    """ Like draw_set() but computes the whole grid at once with a set function from mandelbrot.py, and
+        draws each column as line segments of the same colour with screen updates turned off.
+        @param set_function: like mandelbrot.mandelbrot_set(cx,cy, return_score), default is that.
+        @param maxticks: like mandelbrot_dist(), so that the colours are the same. """
+    import mandelbrot
+    set_function = set_function or mandelbrot.mandelbrot_set
+    scale = 3.0/zoom/max([max(xrange), max(yrange)])
+    x0,y0 = x0y0
+    xs, ys = np.arange(*xrange, step), np.arange(*yrange, step)
+    xx, yy = np.meshgrid(xs, ys, indexing='ij')
+    iterations = mandelbrot.MAX_ITERATIONS
+    mandelbrot.MAX_ITERATIONS = maxticks+1 # Ticks 0 ... maxticks like mandelbrot_dist()
+    try:
+        score = set_function((xx-x0)*scale, (yy-y0)*scale, True) # Score is 1 - tick/MAX_ITERATIONS
+    finally:
+        mandelbrot.MAX_ITERATIONS = iterations
+    dist = np.rint((1-score)*(maxticks+1))/maxticks # Never diverging ends on tick maxticks, so 1.0 like mandelbrot_dist()
+    R, G, B = dist2colours(dist, colmap=colmap)
+    
+    tracer = turtle.tracer()
+    turtle.tracer(0, 0) # No screen updates until done
+    turtle.colormode(255)
+    turtle.width(step)
+    for i, x in enumerate(xs):
+        col = R[i]*256*256 + G[i]*256 + B[i]
+        starts = np.flatnonzero(np.r_[True, col[1:] != col[:-1]]) # Where each run of the same colour starts
+        ends = np.r_[starts[1:], len(col)]
+        turtle.penup()
+        for s, e in zip(starts, ends):
+            turtle.setpos(x+x0, ys[s]+y0-step/2)
+            turtle.pendown()
+            turtle.color((int(R[i][s]), int(G[i][s]), int(B[i][s])))
+            turtle.setpos(x+x0, ys[e-1]+y0+step/2)
+            turtle.penup()
+    turtle.update()
+    turtle.tracer(tracer)
+
             
 if __name__ == "__main__":
-    draw_set(set_function=mandelbrot_dist)
\ No newline at end of file
+    if (sys.argv[-1] == "--slow"): # Pixel by pixel, as it was done originally
+        draw_set(set_function=mandelbrot_dist)
+    else:
+        draw_set_fast()
\ No newline at end of file
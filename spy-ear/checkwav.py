@@ -1,29 +1,166 @@
 # Some basic debugging on recorded wav files. Created for spy-ear project.
 # Record wav files as follows:
 # bash$  wget 192.168.1.44 -o aud.wav
+#
+# Long recordings can be analysed without loading them into memory:
+# bash$  python checkwav.py aud.wav --stream --out aud_filtered.wav
+import sys, struct, argparse
 from scipy.io import wavfile
 from scipy.signal import medfilt
 import numpy as np
-import sounddevice as sd
 import pylab as plt
 
 
-# AnalogAudio(channels=1) & ConverterAutoCenter(channels=2), using 3.3V
-fn = './aud_2.wav' # Three whistles
-# Now sample rate is *4
-fn = './aud_1.wav' # Three whistles
-# Now sample rate is *8
-fn = './aud.wav' # Spoken words
+def open_wav(fn):
+    """ @return: (samplerate, data) with data memory-mapped from the file, so nothing is read until it's used """
+    return wavfile.read(fn, mmap=True)
 
-samplerate, data = wavfile.read(fn)
-print(samplerate, np.shape(data))
+def center_level(data, samples=2**20):
+    """ @return: the median level of 'data', estimated from at most ~'samples' evenly spaced samples """
+    step = max(1, len(data)//samples)
+    return np.median(data[::step], axis=0)
 
-data_ = 10*(data-np.median(data))
-data_ = medfilt(data_, 7)
-sd.play(data_, samplerate)
+def filter_chunks(data, level, gain=10, kernel=7, chunk=2**20):
+    """ Median centering, gain & median filtering of 'data' in chunks, as 'gain*(data-level)' followed by 'medfilt'
+        over time. Each chunk is read with kernel//2 samples of overlap on either side, so the result is identical
+        to filtering the whole array at once.
+        @param data: (samples) or (samples x channels) array, e.g. memory-mapped.
+        @return: generator of (start sample, filtered float64 chunk) """
+    half = kernel//2
+    size = kernel if (data.ndim == 1) else (kernel,) + (1,)*(data.ndim-1)
+    for start in range(0, len(data), chunk):
+        stop = min(start+chunk, len(data))
+        lo, hi = max(0, start-half), min(len(data), stop+half)
+        block = gain*(np.asarray(data[lo:hi], float) - level)
+        # medfilt zero-pads at the ends of the block, which is only correct at the ends of the file
+        filtered = medfilt(block, size)
+        yield start, filtered[start-lo:len(filtered)-(hi-stop)]
 
 
-axes = plt.subplots(2, 1)[1]
-axes[0].plot(data)
-axes[1].plot(data_)
-plt.show()
\ No newline at end of file
+class MinMax(object):
+    """ Accumulates the min & max of a stream into a fixed number of bins, for plotting long signals. """
+    def __init__(self, length, bins=2000):
+        self.step = max(1, -(-length//bins)) # Samples per bin
+        self.lo, self.hi = [], []
+        self._tail = None # Samples left over from the previous chunk, to fill the current bin
+
+    def add(self, chunk):
+        if (self._tail is not None):
+            chunk = np.concatenate([self._tail, chunk])
+        n = (len(chunk)//self.step)*self.step
+        if (n > 0):
+            bins = chunk[:n].reshape((-1, self.step) + chunk.shape[1:])
+            self.lo.append(bins.min(axis=1)); self.hi.append(bins.max(axis=1))
+        self._tail = chunk[n:] if (n < len(chunk)) else None
+
+    def result(self):
+        """ @return: (first sample of each bin, min, max) """
+        lo, hi = list(self.lo), list(self.hi)
+        if (self._tail is not None):
+            lo.append(self._tail.min(axis=0)[None]); hi.append(self._tail.max(axis=0)[None])
+        lo, hi = np.concatenate(lo), np.concatenate(hi)
+        return np.arange(len(lo))*self.step, lo, hi
+
+
+class WavWriter(object):
+    """ Writes a WAV file incrementally: the header's sizes are filled in on 'close()'.
+        Integer data is written as 16 or 32 bit PCM, clipped to range; floats are written as 32 bit IEEE float. """
+    def __init__(self, fn, samplerate, channels=1, dtype=np.int16):
+        self.dtype = np.dtype(dtype)
+        assert self.dtype in (np.int16, np.int32, np.float32), "Only int16, int32 & float32 WAV output is supported"
+        self.f = open(fn, "wb")
+        self.channels, self.frames = channels, 0
+        fmt = 3 if (self.dtype.kind == "f") else 1
+        width = self.dtype.itemsize
+        self.f.write(b"RIFF" + struct.pack("<I", 0) + b"WAVE")
+        self.f.write(b"fmt " + struct.pack("<IHHIIHH", 16, fmt, channels, samplerate, samplerate*channels*width, channels*width, 8*width))
+        self.f.write(b"data" + struct.pack("<I", 0))
+
+    def write(self, chunk):
+        if (self.dtype.kind == "i"):
+            info = np.iinfo(self.dtype)
+            chunk = np.clip(np.round(chunk), info.min, info.max)
+        chunk = np.asarray(chunk, self.dtype)
+        self.f.write(chunk.tobytes())
+        self.frames += len(chunk)
+
+    def close(self):
+        size = self.frames*self.channels*self.dtype.itemsize
+        self.f.seek(4); self.f.write(struct.pack("<I", 36+size))
+        self.f.seek(40); self.f.write(struct.pack("<I", size))
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def analyse_stream(fn, out=None, gain=10, kernel=7, chunk=2**20, bins=2000, plot=True):
+    """ Same as the basic analysis below, but streaming through the file in chunks so that multi-hour recordings
+        fit in memory. The filtered audio is written to 'out' as it's computed, rather than played.
+        @return: (samplerate, (bin starts, min, max) of the raw data, (bin starts, min, max) of the filtered data) """
+    samplerate, data = open_wav(fn)
+    channels = 1 if (data.ndim == 1) else data.shape[1]
+    print(samplerate, np.shape(data))
+    level = center_level(data)
+    raw, filt = MinMax(len(data), bins), MinMax(len(data), bins)
+    dtype = data.dtype if (data.dtype in (np.int16, np.int32)) else np.float32
+    writer = WavWriter(out, samplerate, channels, dtype) if out else None
+    try:
+        for start, filtered in filter_chunks(data, level, gain, kernel, chunk):
+            raw.add(np.asarray(data[start:start+len(filtered)]))
+            filt.add(filtered)
+            if writer:
+                writer.write(filtered)
+    finally:
+        if writer:
+            writer.close()
+    raw, filt = raw.result(), filt.result()
+
+    if plot:
+        axes = plt.subplots(2, 1, sharex=True)[1]
+        for ax, (t, lo, hi) in zip(axes, [raw, filt]):
+            t = t/samplerate
+            for c in range(1 if (lo.ndim == 1) else lo.shape[1]):
+                ax.fill_between(t, lo if (lo.ndim == 1) else lo[:,c], hi if (hi.ndim == 1) else hi[:,c], step="post", lw=0.5)
+        axes[1].set_xlabel("time [sec]")
+        plt.show()
+    return samplerate, raw, filt
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Basic debugging on recorded wav files.")
+    parser.add_argument("fn", nargs="?", default="./aud.wav")
+    parser.add_argument("--stream", action="store_true", help="process the file in chunks, for long recordings")
+    parser.add_argument("--out", default=None, help="--stream: write the filtered audio to this WAV file")
+    parser.add_argument("--bins", type=int, default=2000, help="--stream: number of min/max bins to plot")
+    args = parser.parse_args()
+
+    if args.stream:
+        analyse_stream(args.fn, args.out, bins=args.bins)
+        sys.exit(0)
+
+    import sounddevice as sd
+
+    # AnalogAudio(channels=1) & ConverterAutoCenter(channels=2), using 3.3V
+    fn = './aud_2.wav' # Three whistles
+    # Now sample rate is *4
+    fn = './aud_1.wav' # Three whistles
+    # Now sample rate is *8
+    fn = './aud.wav' # Spoken words
+    fn = args.fn
+
+    samplerate, data = wavfile.read(fn)
+    print(samplerate, np.shape(data))
+
+    data_ = 10*(data-np.median(data))
+    data_ = medfilt(data_, 7)
+    sd.play(data_, samplerate)
+
+
+    axes = plt.subplots(2, 1)[1]
+    axes[0].plot(data)
+    axes[1].plot(data_)
+    plt.show()
@@ -0,0 +1,318 @@
+# Live listening to the spy-ear wavserver, rather than first recording files with wget (see checkwav.py).
+# The HTTP WAV stream is read in fixed size chunks, processed through a pipeline of DSP stages, and queued in a
+# ring buffer for playback & optionally written to a file.
+# bash$  python wavstream.py http://192.168.1.44 --out live.wav
+#
+# To test without the ESP32, serve a recorded file at its real-time rate & listen to that:
+# bash$  python wavstream.py --serve aud.wav --port 8044 &
+# bash$  python wavstream.py http://localhost:8044
+import time, struct, threading, argparse
+import urllib.request
+from collections import deque
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from scipy.signal import lfilter, medfilt
+import numpy as np
+from checkwav import WavWriter
+
+
+def read_wav_header(stream):
+    """ Reads the RIFF header up to the start of the sample data. The sizes in the header are ignored since
+        a live stream doesn't have a known length.
+        @return: (samplerate, channels, dtype) """
+    def read(n):
+        b = stream.read(n)
+        if (len(b) < n):
+            raise EOFError("WAV stream ended in the header")
+        return b
+    riff, _, wave = struct.unpack("<4sI4s", read(12))
+    assert (riff == b"RIFF") and (wave == b"WAVE"), "Not a WAV stream"
+    fmt = None
+    while True:
+        tag, size = struct.unpack("<4sI", read(8))
+        if (tag == b"data"):
+            break
+        body = read(size + size%2)
+        if (tag == b"fmt "):
+            fmt = struct.unpack("<HHIIHH", body[:16])
+    assert fmt, "WAV stream has no format chunk"
+    code, channels, samplerate, _, _, bits = fmt
+    dtype = {(1,8):np.uint8, (1,16):np.int16, (1,32):np.int32, (3,32):np.float32}[(code, bits)]
+    return samplerate, channels, np.dtype(dtype)
+
+def to_float(samples):
+    """ @return: the samples as float32 scaled to [-1,1) full scale """
+    if (samples.dtype == np.uint8):
+        return (samples.astype(np.float32) - 128) / 128
+    if (samples.dtype.kind == "i"):
+        return samples.astype(np.float32) / -np.iinfo(samples.dtype).min
+    return samples.astype(np.float32)
+
+
+class RingBuffer(object):
+    """ Preallocated (frames x channels) float32 ring buffer between a single writer & a single reader thread.
+        If the writer gets too far ahead the oldest frames are dropped ('overruns').
+        Both copy under the lock, since the writer may be overwriting the frames the reader is copying. """
+    def __init__(self, frames, channels=1):
+        self.data = np.zeros((frames, channels), np.float32)
+        self.head, self.tail = 0, 0 # Total frames written & read
+        self.overruns = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.head - self.tail
+
+    def write(self, chunk):
+        N = len(self.data)
+        if (len(chunk) > N):
+            self.overruns += len(chunk)-N
+            chunk = chunk[-N:]
+        with self.lock:
+            i = self.head % N
+            n = min(len(chunk), N-i)
+            self.data[i:i+n] = chunk[:n]
+            self.data[:len(chunk)-n] = chunk[n:]
+            self.head += len(chunk)
+            if (self.head - self.tail > N):
+                self.overruns += self.head-self.tail-N
+                self.tail = self.head - N
+
+    def read(self, out):
+        """ Fills 'out' with the oldest frames, or as many as there are, and zeros the rest.
+            @return: the number of frames read """
+        N = len(self.data)
+        with self.lock:
+            count = min(len(out), self.head-self.tail)
+            i = self.tail % N
+            n = min(count, N-i)
+            out[:n] = self.data[i:i+n]
+            out[n:count] = self.data[:count-n]
+            self.tail += count
+        out[count:] = 0
+        return count
+
+
+# DSP stages: callables that process (frames x channels) chunks, keeping their state between chunks
+
+class DCBlock(object):
+    """ Removes the DC level with the single pole high pass filter y[n] = x[n] - x[n-1] + a*y[n-1] """
+    def __init__(self, channels=1, a=0.995):
+        self.b, self.a = [1, -1], [1, -a]
+        self.zi = np.zeros((1, channels))
+
+    def __call__(self, chunk):
+        y, self.zi = lfilter(self.b, self.a, chunk, axis=0, zi=self.zi)
+        return y
+
+class IIRFilter(object):
+    """ Arbitrary IIR filter with coefficients (b, a) e.g. from scipy.signal.butter """
+    def __init__(self, b, a, channels=1):
+        self.b, self.a = b, a
+        self.zi = np.zeros((max(len(a), len(b))-1, channels))
+
+    def __call__(self, chunk):
+        y, self.zi = lfilter(self.b, self.a, chunk, axis=0, zi=self.zi)
+        return y
+
+class MedianFilter(object):
+    """ Median filter over time, like 'medfilt' on the whole stream but delayed by kernel//2 frames """
+    def __init__(self, channels=1, kernel=7):
+        self.kernel = kernel
+        self.history = np.zeros((kernel-1, channels), np.float32)
+
+    def __call__(self, chunk):
+        block = np.concatenate([self.history, chunk])
+        self.history = block[len(block)-(self.kernel-1):]
+        return medfilt(block, (self.kernel, 1))[self.kernel//2:len(block)-self.kernel//2]
+
+class Gain(object):
+    """ Amplifies & clips to full scale """
+    def __init__(self, channels=1, gain=10):
+        self.gain = gain
+
+    def __call__(self, chunk):
+        return np.clip(self.gain*chunk, -1, 1)
+
+
+class WavStream(object):
+    """ Reads a live WAV stream over HTTP, runs it through the DSP stages and plays it.
+        Usage:
+            stream = WavStream("http://192.168.1.44")
+            stream.run(duration=60) # or start() ... stop()
+            print(stream.stats())
+    """
+    def __init__(self, url, stages=None, chunk=512, buffer_sec=1.0, prefill_sec=0.1, play=True, out=None):
+        """ @param stages: list of functions (channels) -> stage, default DC removal, median filter & gain like checkwav.py
+            @param chunk: number of frames to read from the stream at a time
+            @param buffer_sec: size of the ring buffer [sec]
+            @param prefill_sec: playback only starts once this much is buffered, and again after an underrun
+            @param play: True to play with 'sounddevice', else the ring buffer is drained by a clock at the same rate (for testing)
+            @param out: filename to write the processed audio to, default None """
+        self.response = urllib.request.urlopen(url)
+        self.samplerate, self.channels, self.dtype = read_wav_header(self.response)
+        stages = stages or [DCBlock, MedianFilter, Gain]
+        self.stages = [s(self.channels) for s in stages]
+        self.chunk, self.play, self.out = chunk, play, out
+        self.ring = RingBuffer(int(buffer_sec*self.samplerate), self.channels)
+        self.prefill = int(prefill_sec*self.samplerate)
+        self._raw = bytearray(chunk*self.channels*self.dtype.itemsize) # Reused for every chunk
+        self._running, self._threads = False, []
+        self._playing = False
+        self.underruns, self.frames_in, self.frames_out = 0, 0, 0
+        self.latencies, self.processing = deque(maxlen=10000), deque(maxlen=10000) # Seconds, per playback block & per chunk, for the last few minutes
+        self.device_latency = 0
+
+    def _read_chunk(self):
+        """ @return: the next chunk as (frames x channels) samples, shorter at the end of the stream """
+        view, n = memoryview(self._raw), 0
+        while (n < len(view)):
+            r = self.response.readinto(view[n:])
+            if not r:
+                break
+            n += r
+        n -= n % (self.channels*self.dtype.itemsize)
+        return np.frombuffer(self._raw, self.dtype, n//self.dtype.itemsize).reshape(-1, self.channels)
+
+    def _ingest(self):
+        writer = WavWriter(self.out, self.samplerate, self.channels, np.int16) if self.out else None
+        try:
+            while self._running:
+                samples = self._read_chunk()
+                if (len(samples) == 0):
+                    break
+                t0 = time.perf_counter()
+                chunk = to_float(samples)
+                for stage in self.stages:
+                    chunk = stage(chunk)
+                self.processing.append(time.perf_counter()-t0)
+                self.ring.write(chunk)
+                self.frames_in += len(chunk)
+                if writer:
+                    writer.write(chunk*32767)
+        finally:
+            self._running = False
+            if writer:
+                writer.close()
+
+    def _fill(self, out):
+        """ Fills the playback block 'out' from the ring buffer, counting underruns """
+        if not self._playing:
+            if (len(self.ring) < self.prefill) and self._running:
+                out[:] = 0
+                return
+            self._playing = True
+        self.latencies.append(len(self.ring)/self.samplerate + self.device_latency)
+        n = self.ring.read(out)
+        self.frames_out += n
+        if (n < len(out)) and self._running: # Ran dry before the end of the stream
+            self.underruns += 1
+            self._playing = False
+
+    def _clock(self):
+        """ Drains the ring buffer at the sample rate, in place of a sound card """
+        out = np.zeros((self.chunk, self.channels), np.float32)
+        t = time.perf_counter()
+        while self._running or len(self.ring):
+            self._fill(out)
+            t += len(out)/self.samplerate
+            time.sleep(max(0, t-time.perf_counter()))
+
+    def start(self):
+        self._running = True
+        self._threads = [threading.Thread(target=self._ingest, daemon=True)]
+        if self.play:
+            import sounddevice as sd
+            self._device = sd.OutputStream(samplerate=self.samplerate, channels=self.channels, dtype="float32",
+                                           blocksize=self.chunk, callback=lambda out, frames, t, status: self._fill(out))
+            self.device_latency = self._device.latency
+            self._device.start()
+        else:
+            self._threads.append(threading.Thread(target=self._clock, daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._running = False
+        for thread in self._threads:
+            thread.join()
+        if self.play:
+            while len(self.ring): # Let it play out
+                time.sleep(self.chunk/self.samplerate)
+            self._device.stop(); self._device.close()
+        self.response.close()
+
+    def run(self, duration=None):
+        """ Plays the stream until it ends, or for 'duration' [sec] """
+        self.start()
+        t_end = time.time() + (duration if duration else np.inf)
+        try:
+            while self._running and (time.time() < t_end):
+                time.sleep(0.1)
+        finally:
+            self.stop()
+
+    def stats(self):
+        """ @return: dict with frames in & out, underruns, overruns [frames], latency [sec] & processing time per chunk [sec],
+                    the latter over the last 10000 blocks & chunks """
+        lat, proc = np.asarray(self.latencies or [0]), np.asarray(self.processing or [0])
+        return dict(frames_in=self.frames_in, frames_out=self.frames_out, underruns=self.underruns, overruns=self.ring.overruns,
+                    latency_mean=lat.mean(), latency_max=lat.max(), processing_mean=proc.mean(), processing_max=proc.max())
+
+
+def serve_wav(fn, port=8044, realtime=True):
+    """ Serves the WAV file 'fn' over HTTP like the ESP32 wavserver, paced at its sample rate if 'realtime'.
+        @return: the HTTPServer, serving in a background thread; call 'shutdown()' to stop it """
+    with open(fn, "rb") as f:
+        header = read_wav_header(f)
+        offset = f.tell()
+    samplerate, channels, dtype = header
+    bytes_per_sec = samplerate*channels*dtype.itemsize
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "audio/wav")
+            self.end_headers()
+            with open(fn, "rb") as f:
+                self.wfile.write(f.read(offset))
+                block = bytes_per_sec//50
+                t = time.perf_counter()
+                try:
+                    for data in iter(lambda: f.read(block), b""):
+                        self.wfile.write(data)
+                        if realtime:
+                            t += len(data)/bytes_per_sec
+                            time.sleep(max(0, t-time.perf_counter()))
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Listen to the spy-ear wavserver live.")
+    parser.add_argument("url", nargs="?", default="http://192.168.1.44")
+    parser.add_argument("--out", default=None, help="also write the processed audio to this WAV file")
+    parser.add_argument("--duration", type=float, default=None, help="[sec], default until the stream ends")
+    parser.add_argument("--chunk", type=int, default=512, help="frames per chunk")
+    parser.add_argument("--gain", type=float, default=10)
+    parser.add_argument("--no-play", action="store_true", help="don't use the sound card, e.g. to only record")
+    parser.add_argument("--serve", default=None, help="serve this WAV file instead, as a stand-in for the wavserver")
+    parser.add_argument("--port", type=int, default=8044)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve_wav(args.serve, args.port)
+        print("Serving %s on port %d"%(args.serve, args.port))
+        while True:
+            time.sleep(1)
+
+    stages = [DCBlock, MedianFilter, lambda channels: Gain(channels, args.gain)]
+    stream = WavStream(args.url, stages, args.chunk, play=not args.no_play, out=args.out)
+    print(stream.samplerate, stream.channels, stream.dtype)
+    stream.run(args.duration)
+    print(stream.stats())